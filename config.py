@@ -27,6 +27,13 @@ if not API_KEY:
 # Storage path setting
 LOCAL_STORAGE_PATH = os.environ.get('LOCAL_STORAGE_PATH', '/tmp')
 
+# Audio merges: join MP3 inputs that allow it with a server-side GCS compose
+CONCAT_WITH_GCS_COMPOSE = os.environ.get('CONCAT_WITH_GCS_COMPOSE', 'true').lower() == 'true'
+
+# Audio merges: keep merged results in GCS so an identical request (e.g. a
+# webhook retry) is answered without redoing the work
+MERGE_CACHE_ENABLED = os.environ.get('MERGE_CACHE_ENABLED', 'true').lower() == 'true'
+
 # GCP environment variables
 GCP_SA_CREDENTIALS = os.environ.get('GCP_SA_CREDENTIALS', '')
 GCP_BUCKET_NAME = os.environ.get('GCP_BUCKET_NAME', '')
@@ -32,14 +32,27 @@ def cloud_run_job_task():
     """Execute a single job request and shut down."""
     path = os.environ.get("GCP_JOB_PATH")
     payload_str = os.environ.get("GCP_JOB_PAYLOAD")
+    # Large payloads are handed over as a GCS object instead of an env var
+    input_uri = os.environ.get("JOB_INPUT_URI")
     api_key = os.environ.get("API_KEY")
 
-    if not (path and payload_str and api_key):
-        print("⚠️ Missing required environment variables: GCP_JOB_PATH, GCP_JOB_PAYLOAD, or API_KEY")
+    if not (path and (payload_str or input_uri) and api_key):
+        print("⚠️ Missing required environment variables: GCP_JOB_PATH, GCP_JOB_PAYLOAD (or JOB_INPUT_URI), or API_KEY")
+        # Nothing retries with this payload, so don't leave it behind
+        if input_uri:
+            from services.gcp_toolkit import delete_gcs_object
+            delete_gcs_object(input_uri)
         os._exit(1)
 
+    # The except branches only record the exit code: calling os._exit() there
+    # would skip the finally block and leave the payload object behind
+    exit_code = 0
     try:
-        payload = json.loads(payload_str)
+        if input_uri:
+            from services.gcp_toolkit import download_json_from_gcs
+            payload = download_json_from_gcs(input_uri)
+        else:
+            payload = json.loads(payload_str)
         webhook_url = payload.get("webhook_url")
 
         print(f"📤 Executing GCP job request to {path}...")
@@ -98,15 +111,18 @@ def cloud_run_job_task():
                 requests.post(webhook_url, json=webhook_data)
         except:
             pass
-        os._exit(1)
+        exit_code = 1
 
     except Exception as e:
         print(f"❌ Unexpected error: {e}")
-        os._exit(1)
+        exit_code = 1
 
     finally:
+        if input_uri:
+            from services.gcp_toolkit import delete_gcs_object
+            delete_gcs_object(input_uri)
         print("🛑 Shutting down...")
-        os._exit(0)
+        os._exit(exit_code)
 
 
 def when_ready(server):
@@ -1,3 +1,4 @@
+import os
 from flask import Blueprint
 from app_utils import *
 import logging
@@ -41,11 +42,12 @@ def combine_audio(job_id, data):
         f"Job {job_id}: Received combine-audio request for {len(media_urls)} audio files"
     )
 
+    output_file = None
     try:
         output_file = process_audio_concatenate(media_urls, job_id)
         logger.info(f"Job {job_id}: Audio combination process completed successfully")
 
-        cloud_url = upload_file(output_file)
+        cloud_url = upload_file(output_file, f"merged_audio/{job_id}.mp3")
         logger.info(
             f"Job {job_id}: Combined audio uploaded to cloud storage: {cloud_url}"
         )
@@ -55,3 +57,11 @@ def combine_audio(job_id, data):
     except Exception as e:
         logger.error(f"Job {job_id}: Error during audio combination process - {str(e)}")
         return str(e), "/v1/audio/concatenate", 500
+
+    finally:
+        # The merged file is only needed until it has been uploaded
+        if output_file is not None:
+            try:
+                os.remove(output_file)
+            except FileNotFoundError:
+                pass
@@ -1,26 +1,317 @@
 # Copyright (c) 2025 Stephen G. Pope
 # (License header omitted for brevity)
 
-import json
 import logging
 import os
+import shutil
+import subprocess
+import tempfile
+import threading
 import uuid
+import requests
+from concurrent.futures import ThreadPoolExecutor
 from flask import Blueprint, request, jsonify
 
-# FIX: 从 audio_combiner 导入核心处理函数
-from services.audio_combiner import process_audio_concatenation 
+from config import LOCAL_STORAGE_PATH, CONCAT_WITH_GCS_COMPOSE, MERGE_CACHE_ENABLED
+from services.cloud_storage import upload_stream, get_storage_provider, GCPStorageProvider
+from services.file_management import download_file, get_http_session, DOWNLOAD_TIMEOUT
+from services.mp3_toolkit import MP3_HEAD_PROBE_BYTES, ID3V1_TAG_SIZE, composable_mp3_info, mp3s_composable
+from services.ffmpeg_toolkit import can_stream_copy, write_concat_list, FFMPEG_RW_TIMEOUT_US
 # 假设 gcp_toolkit.py 提供了触发 Cloud Run Job 的功能
-from services.gcp_toolkit import trigger_cloud_run_job 
+from services.gcp_toolkit import (
+    trigger_cloud_run_job,
+    compose_urls_to_gcs,
+    upload_json_to_gcs,
+    get_gcs_object_url,
+    copy_gcs_object,
+    merge_cache_blob_name
+)
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on simultaneous input downloads per job, so a long audio_urls
+# list does not saturate the NIC or hammer the source host.
+MAX_DOWNLOAD_WORKERS = int(os.getenv('MAX_DOWNLOAD_WORKERS', '8'))
+
+# Let FFmpeg read uniform MP3 inputs directly from their URLs instead of
+# downloading them to LOCAL_STORAGE_PATH first.
+CONCAT_FROM_URLS = os.getenv('CONCAT_FROM_URLS', 'true').lower() == 'true'
+
+# FFmpeg is killed if a single merge runs longer than this many seconds, so a
+# stalled input cannot hold a job slot forever.
+FFMPEG_MERGE_TIMEOUT = float(os.getenv('FFMPEG_MERGE_TIMEOUT', '3600'))
+
+# Normalization encoders running at once across all jobs in this process, so
+# concurrent jobs share the cores instead of each starting one per core.
+_NORMALIZE_SLOTS = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+
+def _inspect_composable_url(url):
+    """
+    Fetches the first and last bytes of the MP3 at url with range requests
+    and returns its composable_mp3_info, or None if it cannot be joined byte
+    for byte or the server does not support range requests.
+    """
+    session = get_http_session()
+    try:
+        with session.get(url, headers={'Range': f'bytes=0-{MP3_HEAD_PROBE_BYTES - 1}'},
+                         stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+            r.raise_for_status()
+            # A server that ignores Range answers 200 with the whole file;
+            # give up before reading its body
+            if r.status_code != 206:
+                return None
+            size = int(r.headers['Content-Range'].rsplit('/', 1)[1])
+            head = r.raw.read(MP3_HEAD_PROBE_BYTES, decode_content=True)
+
+        if size <= len(head):
+            tail = head[-ID3V1_TAG_SIZE:]
+        else:
+            with session.get(url, headers={'Range': f'bytes=-{ID3V1_TAG_SIZE}'},
+                             stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+                if r.status_code != 206:
+                    return None
+                tail = r.raw.read(ID3V1_TAG_SIZE, decode_content=True)
+    except (requests.RequestException, KeyError, ValueError) as e:
+        logger.warning("Could not inspect %s for compose: %s", url, e)
+        return None
+    return composable_mp3_info(head, size, tail)
+
+
+def _normalize_to_mp3(input_path, output_path):
+    """
+    Re-encodes input_path to 44.1 kHz stereo 192k CBR MP3, so any set of
+    normalized files can be joined with '-c copy'.
+    """
+    cmd = [
+        'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+        '-i', input_path,
+        '-vn', '-c:a', 'libmp3lame', '-b:a', '192k', '-ar', '44100', '-ac', '2',
+        output_path
+    ]
+    with _NORMALIZE_SLOTS:
+        result = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        stderr = result.stderr.decode('utf-8', errors='replace')
+        raise Exception(f"FFmpeg normalization of {input_path} failed: {stderr}")
+    return output_path
+
+
+class _FFmpegOutput:
+    """
+    Read-only view of a running FFmpeg's stdout for upload_stream. At EOF it
+    waits for FFmpeg and raises if FFmpeg failed, so the upload errors out
+    before it is finalized and a merge that died halfway never turns into a
+    truncated public object.
+    """
+
+    def __init__(self, process, stderr_file):
+        self._process = process
+        self._stderr_file = stderr_file
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def read(self, size=-1):
+        data = self._process.stdout.read(size)
+        if not data or size is None or size < 0:
+            self._check_exit()
+        return data
+
+    def _check_exit(self):
+        returncode = self._process.wait()
+        if returncode != 0:
+            self._stderr_file.seek(0)
+            stderr = self._stderr_file.read().decode('utf-8', errors='replace')
+            raise Exception(f"FFmpeg merge failed: {stderr}")
+
+
+def _run_concat(concat_list_path, codec_args, destination_path, work_dir, input_args=()):
+    """
+    Runs FFmpeg's concat demuxer over concat_list_path and streams the merged
+    MP3 from FFmpeg's stdout straight into cloud storage, so the output is
+    never written to or re-read from local disk.
+
+    Returns:
+        str: The public URL of the uploaded file.
+    """
+    cmd = [
+        'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+        *input_args,
+        '-thread_queue_size', '1024', '-fflags', '+genpts',
+        '-f', 'concat', '-safe', '0',
+        '-i', concat_list_path,
+        *codec_args,
+        '-f', 'mp3', 'pipe:1'
+    ]
+    logger.info("Running FFmpeg command for merge: %s", cmd)
+    # stderr goes to a temp file rather than a pipe so a chatty FFmpeg can
+    # never block on it while we are busy draining stdout
+    with tempfile.TemporaryFile(dir=work_dir) as stderr_file:
+        process = subprocess.Popen(
+            cmd,
+            cwd=work_dir,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=stderr_file,
+            bufsize=4 * 1024 * 1024
+        )
+        # A killed FFmpeg exits non-zero, so the upload is never finalized
+        watchdog = threading.Timer(FFMPEG_MERGE_TIMEOUT, process.kill)
+        watchdog.start()
+        try:
+            url = upload_stream(_FFmpegOutput(process, stderr_file), destination_path, content_type='audio/mpeg')
+        finally:
+            # Closing stdout stops FFmpeg early if the upload failed
+            process.stdout.close()
+            returncode = process.wait()
+            watchdog.cancel()
+
+        if returncode != 0:
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode('utf-8', errors='replace')
+            raise Exception(f"FFmpeg merge failed: {stderr}")
+
+    return url
+
+
+def process_audio_concatenation(audio_urls, job_id):
+    """
+    Merges the audio files with FFmpeg's concat demuxer and uploads the merged
+    MP3 to cloud storage.
+
+    Uniform MP3 inputs served over HTTP(S) are joined with a GCS compose when
+    the storage provider is GCS, or stream-copied by FFmpeg straight from
+    their URLs. Otherwise, or if that fails (e.g. an expired signed URL), the
+    inputs are downloaded first.
+
+    Args:
+        audio_urls (list): Public URLs of the audio files, in merge order.
+        job_id (str): Unique job identifier, used to name local and remote files.
+
+    Returns:
+        str: The public URL of the merged MP3.
+    """
+    provider = get_storage_provider()
+    cache_blob_name = None
+    if MERGE_CACHE_ENABLED and isinstance(provider, GCPStorageProvider):
+        # The cache is an optimization: a failed lookup must not fail the merge
+        try:
+            cache_blob_name = merge_cache_blob_name(audio_urls, "merged_audio/cache")
+            cached_url = cache_blob_name and get_gcs_object_url(cache_blob_name, provider.bucket_name)
+        except Exception as e:
+            logger.warning("Job %s: merge cache lookup failed, merging without it: %s", job_id, e)
+            cache_blob_name = cached_url = None
+        if cached_url:
+            logger.info("Job %s: cache hit, reusing %s", job_id, cached_url)
+            return cached_url
+
+    # Every local file of this job lives in job_dir, so cleanup is a single rmtree
+    job_dir = os.path.join(LOCAL_STORAGE_PATH, f"job_{job_id}")
+    os.makedirs(job_dir, exist_ok=True)
+    concat_list_path = os.path.join(job_dir, "concat_list.txt")
+    destination_path = f"merged_audio/{job_id}.mp3"
+    max_workers = max(1, min(MAX_DOWNLOAD_WORKERS, len(audio_urls)))
+
+    try:
+        result_url = None
+
+        streamable = CONCAT_FROM_URLS and all(url.startswith(('http://', 'https://')) for url in audio_urls)
+        copy_from_urls = streamable and can_stream_copy(audio_urls, max_workers)
+
+        if copy_from_urls:
+            composable = False
+            if CONCAT_WITH_GCS_COMPOSE and isinstance(provider, GCPStorageProvider):
+                # compose joins the files byte for byte, which is only valid when
+                # no clip carries tags or header frames that would land mid-stream
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    composable = mp3s_composable(list(executor.map(_inspect_composable_url, audio_urls)))
+            if composable:
+                try:
+                    result_url = compose_urls_to_gcs(
+                        audio_urls,
+                        provider.bucket_name,
+                        destination_path,
+                        f"staging/{job_id}",
+                        content_type='audio/mpeg',
+                        max_workers=max_workers
+                    )
+                except Exception as e:
+                    logger.warning("GCS compose for job %s failed, merging with FFmpeg instead: %s", job_id, e)
+
+        if result_url is None and copy_from_urls:
+            # Non-seekable HTTP inputs are read front to back, without the
+            # extra range requests FFmpeg would otherwise make while probing;
+            # rw_timeout makes a stalled origin fail the merge instead of hanging it
+            write_concat_list(
+                concat_list_path,
+                audio_urls,
+                file_options={'seekable': '0', 'rw_timeout': FFMPEG_RW_TIMEOUT_US}
+            )
+            try:
+                result_url = _run_concat(
+                    concat_list_path,
+                    ['-c', 'copy'],
+                    destination_path,
+                    job_dir,
+                    input_args=['-protocol_whitelist', 'file,http,https,tls,tcp']
+                )
+            except Exception as e:
+                logger.warning("Merging job %s from URLs failed, downloading inputs instead: %s", job_id, e)
+
+        if result_url is None:
+            # Downloads are network-bound and independent, so fetch them in parallel.
+            # Results are collected in submission order, which the concat list relies on.
+            input_files = []
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(download_file, url, job_dir) for url in audio_urls]
+                for url, future in zip(audio_urls, futures):
+                    input_filename = future.result()
+                    input_files.append(input_filename)
+                    logger.info("Downloaded: %s to %s", url, input_filename)
+
+            if not can_stream_copy(input_files, max_workers):
+                # Encoding is CPU-bound: encode inputs in parallel, at most one per
+                # core across all jobs (see _NORMALIZE_SLOTS), then join the
+                # now-uniform files with a plain stream copy
+                logger.info("Inputs for job %s differ in format, re-encoding to MP3", job_id)
+                normalized_files = [os.path.join(job_dir, f"norm_{i:05d}.mp3") for i in range(len(input_files))]
+                with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+                    input_files = list(executor.map(_normalize_to_mp3, input_files, normalized_files))
+
+            write_concat_list(concat_list_path, [os.path.abspath(f) for f in input_files])
+
+            result_url = _run_concat(concat_list_path, ['-c', 'copy'], destination_path, job_dir)
+
+        if cache_blob_name:
+            try:
+                copy_gcs_object(destination_path, cache_blob_name, provider.bucket_name)
+            except Exception as e:
+                logger.warning("Job %s: could not store the merge in the cache: %s", job_id, e)
+
+        return result_url
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+
 # 使用 job_name 作为 Blueprint name
 concatenate_bp = Blueprint('concatenate', __name__)
 
 # --- Cloud Run Job 环境检测 ---
 # 用于判断当前代码是在主 Web 服务中运行 (需要触发 Job) 
 # 还是在 Cloud Run Job (Batch) 环境中运行 (直接执行处理)
-IS_CLOUD_RUN_JOB_ENV = os.getenv('K_SERVICE') and os.getenv('CLOUD_RUN_EXECUTION')
+# Cloud Run Job 只设置 CLOUD_RUN_JOB (与 app.py 的判断相同)，不会设置 K_SERVICE；
+# 判断错误时 Job 会把请求当作服务端请求，不断触发新的 Job
+IS_CLOUD_RUN_JOB_ENV = os.getenv('CLOUD_RUN_JOB')
+
+# Caps how many merges run at once in this process so a burst of requests
+# does not oversubscribe the CPU and NIC; callers that wait longer than
+# JOB_SLOT_TIMEOUT seconds for a slot get a 429 and should retry.
+_CONCURRENCY = threading.BoundedSemaphore(int(os.getenv('MAX_CONCURRENT_JOBS', '2')))
+JOB_SLOT_TIMEOUT = float(os.getenv('JOB_SLOT_TIMEOUT', '30'))
 
 
 @concatenate_bp.route('/', methods=['POST'])
@@ -38,13 +329,18 @@ def concatenate():
             return jsonify({"error": "The request must contain a list of at least two 'audio_urls'."}), 400
 
         job_id = str(uuid.uuid4())
-        logger.info(f"Received concatenation request for job ID: {job_id}")
+        logger.info("Received concatenation request for job ID: %s", job_id)
 
         if IS_CLOUD_RUN_JOB_ENV:
             # --- 场景 1: 运行在 Cloud Run Job (Batch) 环境中 ---
             # 直接执行繁重的工作
-            logger.info(f"Executing audio combination within job environment: {job_id}")
-            result_url = process_audio_concatenation(audio_urls, job_id)
+            logger.info("Executing audio combination within job environment: %s", job_id)
+            if not _CONCURRENCY.acquire(timeout=JOB_SLOT_TIMEOUT):
+                return jsonify({"error": "Too many concatenation jobs in progress, retry later."}), 429
+            try:
+                result_url = process_audio_concatenation(audio_urls, job_id)
+            finally:
+                _CONCURRENCY.release()
             return jsonify({
                 "job_id": job_id,
                 "status": "success",
@@ -58,12 +354,16 @@ def concatenate():
             # 确保 CLOUD_RUN_JOB_NAME 环境变量已设置，且名称匹配您的 Job
             CLOUD_RUN_JOB_NAME = os.environ.get('CLOUD_RUN_JOB_NAME', 'your-ffmpeg-job-name')
 
-            # 将输入数据作为环境变量传递给 Job
+            # The payload can outgrow Cloud Run's env var size limit, so hand it
+            # to the Job as a GCS object and pass only its URI
+            input_uri = upload_json_to_gcs(data, f"jobs/{job_id}.json")
             overrides = {
                 "container_overrides": [
                     {
                         "env": [
-                            {"name": "JOB_INPUT_DATA", "value": json.dumps(data)},
+                            # cloud_run_job_task replays the payload against this endpoint
+                            {"name": "GCP_JOB_PATH", "value": request.path},
+                            {"name": "JOB_INPUT_URI", "value": input_uri},
                             {"name": "JOB_TYPE", "value": "concatenate"}
                         ]
                     }
@@ -81,9 +381,9 @@ def concatenate():
                     "environment": "service_trigger"
                 }), 202
             else:
-                logger.error(f"Failed to trigger Cloud Run Job: {trigger_result.get('error')}")
+                logger.error("Failed to trigger Cloud Run Job: %s", trigger_result.get('error'))
                 return jsonify({"error": "Failed to initiate background processing.", "details": trigger_result.get('error')}), 500
 
     except Exception as e:
-        logger.error(f"Error during audio concatenation request: {e}", exc_info=True)
+        logger.error("Error during audio concatenation request: %s", e, exc_info=True)
         return jsonify({"error": "Internal server error during processing request."}), 500
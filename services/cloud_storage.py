@@ -5,8 +5,8 @@ import os
 import logging
 from abc import ABC, abstractmethod
 # Assuming these toolkit functions are updated to accept destination_path as well
-from services.gcp_toolkit import upload_to_gcs
-from services.s3_toolkit import upload_to_s3
+from services.gcp_toolkit import upload_to_gcs, upload_stream_to_gcs
+from services.s3_toolkit import upload_to_s3, upload_stream_to_s3
 from config import validate_env_vars
 from urllib.parse import urlparse
 
@@ -30,6 +30,10 @@ class CloudStorageProvider(ABC):
     def upload_file(self, file_path: str, destination_path: str) -> str:
         pass
 
+    @abstractmethod
+    def upload_stream(self, stream, destination_path: str, content_type: str = None) -> str:
+        pass
+
 class GCPStorageProvider(CloudStorageProvider):
     def __init__(self):
         self.bucket_name = os.getenv('GCP_BUCKET_NAME')
@@ -39,6 +43,9 @@ class GCPStorageProvider(CloudStorageProvider):
         # Note: We assume upload_to_gcs now accepts the target destination path
         return upload_to_gcs(file_path, self.bucket_name, destination_path)
 
+    def upload_stream(self, stream, destination_path: str, content_type: str = None) -> str:
+        return upload_stream_to_gcs(stream, self.bucket_name, destination_path, content_type)
+
 class S3CompatibleProvider(CloudStorageProvider):
     def __init__(self):
 
@@ -85,6 +92,18 @@ class S3CompatibleProvider(CloudStorageProvider):
             destination_path # Passed as the final argument
         )
 
+    def upload_stream(self, stream, destination_path: str, content_type: str = None) -> str:
+        return upload_stream_to_s3(
+            stream,
+            self.endpoint_url,
+            self.access_key,
+            self.secret_key,
+            self.bucket_name,
+            self.region,
+            destination_path,
+            content_type
+        )
+
 def get_storage_provider() -> CloudStorageProvider:
     
     if os.getenv('S3_ENDPOINT_URL'):
@@ -116,4 +135,15 @@ def upload_file(file_path: str, destination_path: str) -> str:
     except Exception as e:
         logger.error(f"Error uploading file to cloud storage: {e}")
         raise
-    
+
+def upload_stream(stream, destination_path: str, content_type: str = None) -> str:
+    """Uploads a readable stream to cloud storage without staging it on disk."""
+    provider = get_storage_provider()
+    try:
+        logger.info(f"Uploading stream to cloud storage destination {destination_path}")
+        url = provider.upload_stream(stream, destination_path, content_type)
+        logger.info(f"Stream uploaded successfully: {url}")
+        return url
+    except Exception as e:
+        logger.error(f"Error uploading stream to cloud storage: {e}")
+        raise
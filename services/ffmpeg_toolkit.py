@@ -17,13 +17,107 @@
 
 
 import os
+import json
+import logging
 import ffmpeg
 import requests
-from services.file_management import download_file
+import subprocess
+from collections import deque
+from services.file_management import download_file, DOWNLOAD_TIMEOUT
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
 
 # Set the default local storage directory
 STORAGE_PATH = "/tmp/"
 
+# Number of trailing stderr lines kept for error reporting by run_ffmpeg
+FFMPEG_STDERR_TAIL_LINES = 200
+
+# FFmpeg/ffprobe give up on an input that delivers no data for this long
+# (rw_timeout is in microseconds), the same read timeout downloads use
+FFMPEG_RW_TIMEOUT_US = str(int(DOWNLOAD_TIMEOUT[1] * 1000000))
+
+# Upper bound in seconds on a single ffprobe run
+FFPROBE_TIMEOUT = float(os.environ.get('FFPROBE_TIMEOUT', 120))
+
+def run_ffmpeg(stream_spec):
+    """
+    Run an ffmpeg-python graph without buffering its output in memory.
+
+    stdout is discarded, progress output is disabled and only the last
+    FFMPEG_STDERR_TAIL_LINES lines of stderr are kept, so long jobs cannot
+    pile up megabytes of output. Raises ffmpeg.Error (with that stderr tail)
+    if FFmpeg fails.
+    """
+    args = ffmpeg.compile(stream_spec, overwrite_output=True)
+    args = [args[0], '-nostats', '-loglevel', 'error'] + args[1:]
+
+    process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr_tail = deque(process.stderr, maxlen=FFMPEG_STDERR_TAIL_LINES)
+    process.stderr.close()
+
+    if process.wait() != 0:
+        raise ffmpeg.Error(args[0], None, b''.join(stderr_tail))
+
+def probe_audio_stream(file_path):
+    """
+    Returns the (codec_name, sample_rate, channels) of the first audio stream
+    in file_path (a path or URL), or None if ffprobe cannot read it in time.
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-rw_timeout', FFMPEG_RW_TIMEOUT_US,
+        '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name,sample_rate,channels',
+        '-of', 'json',
+        file_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=FFPROBE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        logger.warning("ffprobe timed out after %ss for %s", FFPROBE_TIMEOUT, file_path)
+        return None
+    if result.returncode != 0:
+        logger.warning("ffprobe failed for %s: %s", file_path, result.stderr)
+        return None
+
+    streams = json.loads(result.stdout).get('streams') or []
+    if not streams:
+        return None
+    stream = streams[0]
+    return (stream.get('codec_name'), stream.get('sample_rate'), stream.get('channels'))
+
+def can_stream_copy(input_files, max_workers):
+    """
+    Checks whether the inputs can be joined with '-c copy': every file must be
+    MP3 with the same sample rate and channel layout, otherwise the merged
+    file comes out broken.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        probes = set(executor.map(probe_audio_stream, input_files))
+
+    if len(probes) != 1:
+        return False
+    probe = probes.pop()
+    return probe is not None and probe[0] == 'mp3'
+
+def write_concat_list(concat_list_path, entries, file_options=None):
+    """
+    Writes an FFmpeg concat demuxer list for entries (paths or URLs) in a
+    single write. Single quotes are escaped so a quote in a URL-derived name
+    cannot break out of the 'file' directive. file_options are emitted as
+    'option' directives, which the demuxer applies when opening each entry.
+    """
+    lines = []
+    for entry in entries:
+        escaped = entry.replace("'", "'\\''")
+        lines.append(f"file '{escaped}'\n")
+        for key, value in (file_options or {}).items():
+            lines.append(f"option {key} {value}\n")
+    with open(concat_list_path, 'wb') as concat_file:
+        concat_file.write(''.join(lines).encode('utf-8'))
+
 def process_conversion(media_url, job_id, bitrate='128k', webhook_url=None):
     """Convert media to MP3 format with specified bitrate."""
     input_filename = download_file(media_url, os.path.join(STORAGE_PATH, f"{job_id}_input"))
@@ -32,12 +126,11 @@ def process_conversion(media_url, job_id, bitrate='128k', webhook_url=None):
 
     try:
         # Convert media file to MP3 with specified bitrate
-        (
+        run_ffmpeg(
             ffmpeg
             .input(input_filename)
             .output(output_path, acodec='libmp3lame', audio_bitrate=bitrate)
             .overwrite_output()
-            .run(capture_stdout=True, capture_stderr=True)
         )
         os.remove(input_filename)
         print(f"Conversion successful: {output_path} with bitrate {bitrate}")
@@ -3,11 +3,21 @@
 
 import os
 import json
+import hashlib
+import shutil
 import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, unquote
 from google.oauth2 import service_account
 from google.cloud import storage
+from google.cloud.storage import transfer_manager
+from google.cloud.storage.retry import DEFAULT_RETRY
 from google.cloud.run_v2 import JobsClient, RunJobRequest
+from google.api_core import retry
 from google.api_core.exceptions import GoogleAPIError
+from services.file_management import get_http_session, DOWNLOAD_TIMEOUT
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,6 +28,17 @@ GCP_BUCKET_NAME = os.getenv('GCP_BUCKET_NAME')
 STORAGE_PATH = "/tmp/"
 gcs_client = None
 
+# Resumable uploads are sent in GCS_UPLOAD_CHUNK_SIZE pieces; files above
+# GCS_PARALLEL_UPLOAD_THRESHOLD are sliced into GCS_PARALLEL_UPLOAD_CHUNK_SIZE
+# parts and uploaded by concurrent workers.
+GCS_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+GCS_PARALLEL_UPLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+GCS_PARALLEL_UPLOAD_THRESHOLD = int(os.getenv('GCS_PARALLEL_UPLOAD_THRESHOLD', 64 * 1024 * 1024))
+GCS_PARALLEL_UPLOAD_WORKERS = int(os.getenv('GCS_PARALLEL_UPLOAD_WORKERS', '8'))
+
+# Maximum number of source objects accepted by a single GCS compose request
+GCS_COMPOSE_MAX_COMPONENTS = 32
+
 def initialize_gcp_client():
     GCP_SA_CREDENTIALS = os.getenv('GCP_SA_CREDENTIALS')
 
@@ -56,9 +77,19 @@ def upload_to_gcs(file_path, bucket_name=GCP_BUCKET_NAME, destination_blob_name=
         bucket = gcs_client.bucket(bucket_name)
         
         # Use the determined target_blob_name to create the blob
-        blob = bucket.blob(target_blob_name) 
-        
-        blob.upload_from_filename(file_path)
+        blob = bucket.blob(target_blob_name, chunk_size=GCS_UPLOAD_CHUNK_SIZE)
+
+        if os.path.getsize(file_path) > GCS_PARALLEL_UPLOAD_THRESHOLD:
+            # Large artifacts: upload the chunks in parallel threads
+            transfer_manager.upload_chunks_concurrently(
+                file_path,
+                blob,
+                chunk_size=GCS_PARALLEL_UPLOAD_CHUNK_SIZE,
+                max_workers=GCS_PARALLEL_UPLOAD_WORKERS,
+                worker_type=transfer_manager.THREAD
+            )
+        else:
+            blob.upload_from_filename(file_path)
         logger.info(f"File uploaded successfully to GCS: {blob.public_url}")
         return blob.public_url
     except Exception as e:
@@ -66,18 +97,316 @@ def upload_to_gcs(file_path, bucket_name=GCP_BUCKET_NAME, destination_blob_name=
         raise
 
 
+def upload_stream_to_gcs(stream, bucket_name=GCP_BUCKET_NAME, destination_blob_name=None, content_type=None):
+    """
+    Uploads a readable, possibly non-seekable stream (e.g. a subprocess pipe)
+    to GCS as a chunked resumable upload, so nothing is staged on local disk.
+    The object is only finalized once the stream reached EOF; if reading it
+    raises, the upload session is abandoned and no object is created.
+    """
+    if not gcs_client:
+        raise ValueError("GCS client is not initialized. Skipping file upload.")
+
+    try:
+        logger.info(f"Uploading stream to Google Cloud Storage as {destination_blob_name}")
+        bucket = gcs_client.bucket(bucket_name)
+        blob = bucket.blob(destination_blob_name)
+        # upload_from_file calls tell() on the stream, which a pipe rejects;
+        # a BlobWriter only ever reads from it
+        writer = blob.open('wb', chunk_size=GCS_UPLOAD_CHUNK_SIZE, content_type=content_type, ignore_flush=True)
+        shutil.copyfileobj(stream, writer, GCS_UPLOAD_CHUNK_SIZE)
+        writer.close()
+        logger.info(f"Stream uploaded successfully to GCS: {blob.public_url}")
+        return blob.public_url
+    except Exception as e:
+        logger.error(f"Error uploading stream to GCS: {e}")
+        raise
+
+
+def _parse_gcs_uri(gcs_uri):
+    bucket_name, _, blob_name = gcs_uri[len("gs://"):].partition('/')
+    return bucket_name, blob_name
+
+
+def parse_gcs_object_url(url):
+    """
+    Returns (bucket_name, blob_name) for a gs:// URI or a plain
+    storage.googleapis.com object URL, or None for anything else. URLs with a
+    query string (e.g. signed URLs) are not parsed.
+    """
+    if url.startswith("gs://"):
+        path = url[len("gs://"):]
+    else:
+        parsed = urlparse(url)
+        if parsed.netloc != "storage.googleapis.com" or parsed.query:
+            return None
+        path = unquote(parsed.path.lstrip('/'))
+    bucket_name, _, blob_name = path.partition('/')
+    if not bucket_name or not blob_name:
+        return None
+    return bucket_name, blob_name
+
+
+def _input_version(url, client):
+    """
+    Returns a string that changes whenever the content behind url changes:
+    the generation of a GCS object, or the ETag/Last-Modified header of
+    another HTTP(S) URL. Returns None if no such version is available.
+    """
+    gcs_object = parse_gcs_object_url(url)
+    if gcs_object and client:
+        try:
+            blob = client.bucket(gcs_object[0]).get_blob(gcs_object[1])
+            return str(blob.generation) if blob else None
+        except GoogleAPIError as e:
+            logger.warning(f"Could not read GCS metadata of {url}: {e}")
+
+    if url.startswith(('http://', 'https://')):
+        try:
+            response = get_http_session().head(url, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+            if response.ok:
+                return response.headers.get('ETag') or response.headers.get('Last-Modified')
+        except requests.RequestException as e:
+            logger.warning(f"Could not read HTTP metadata of {url}: {e}")
+    return None
+
+
+def merge_cache_blob_name(urls, prefix, client=None, max_workers=8):
+    """
+    Returns the name of the cache object, under prefix, that holds the merge
+    of urls (in order), or None if the merge must not be cached.
+
+    The key hashes every URL together with the current version of its
+    content, so overwriting an input in place (e.g. a regenerated clip at
+    the same gs:// path) yields a new key instead of a stale hit. If the
+    version of any input cannot be determined, caching is skipped.
+    """
+    client = client or gcs_client
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as executor:
+        versions = list(executor.map(lambda url: _input_version(url, client), urls))
+    if any(version is None for version in versions):
+        return None
+
+    key_source = "\n".join(f"{url}\t{version}" for url, version in zip(urls, versions))
+    key = hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+    return f"{prefix}/{key}.mp3"
+
+
+def upload_json_to_gcs(data, destination_blob_name, bucket_name=GCP_BUCKET_NAME):
+    """Stores data as a JSON object in GCS and returns its gs:// URI."""
+    if not gcs_client:
+        raise ValueError("GCS client is not initialized. Skipping JSON upload.")
+
+    blob = gcs_client.bucket(bucket_name).blob(destination_blob_name)
+    blob.upload_from_string(json.dumps(data), content_type='application/json')
+    return f"gs://{bucket_name}/{destination_blob_name}"
+
+
+def download_json_from_gcs(gcs_uri):
+    """Fetches and parses a JSON object stored at a gs:// URI."""
+    if not gcs_client:
+        raise ValueError("GCS client is not initialized. Skipping JSON download.")
+
+    bucket_name, blob_name = _parse_gcs_uri(gcs_uri)
+    return json.loads(gcs_client.bucket(bucket_name).blob(blob_name).download_as_bytes())
+
+
+def delete_gcs_object(gcs_uri):
+    """Deletes the object at a gs:// URI. Logs errors but does not raise exceptions."""
+    if not gcs_client:
+        return
+
+    bucket_name, blob_name = _parse_gcs_uri(gcs_uri)
+    try:
+        gcs_client.bucket(bucket_name).blob(blob_name).delete()
+    except Exception as e:
+        logger.warning(f"Failed to delete GCS object {gcs_uri}: {e}")
+
+
+def get_gcs_object_url(blob_name, bucket_name=GCP_BUCKET_NAME):
+    """Returns the public URL of blob_name if the object exists, otherwise None."""
+    if not gcs_client:
+        raise ValueError("GCS client is not initialized. Skipping lookup.")
+
+    blob = gcs_client.bucket(bucket_name).get_blob(blob_name)
+    return blob.public_url if blob is not None else None
+
+
+def copy_gcs_object(source_blob_name, destination_blob_name, bucket_name=GCP_BUCKET_NAME):
+    """Copies an object server-side within bucket_name and returns the copy's public URL."""
+    if not gcs_client:
+        raise ValueError("GCS client is not initialized. Skipping copy.")
+
+    bucket = gcs_client.bucket(bucket_name)
+    return bucket.copy_blob(bucket.blob(source_blob_name), bucket, destination_blob_name).public_url
+
+
+def _rewrite_blob(source, target):
+    """Copies source into target server-side; large cross-location copies take several rewrite calls."""
+    token, _, _ = target.rewrite(source)
+    while token is not None:
+        token, _, _ = target.rewrite(source, token=token)
+    return target
+
+
+def compose_blobs_to_gcs(blobs, bucket_name, destination_blob_name, staging_prefix, content_type=None,
+                         metadata=None, max_workers=8, client=None):
+    """
+    Joins existing GCS objects, in order, into destination_blob_name with a
+    server-side compose, so no object data passes through this machine.
+    Sources outside bucket_name are first rewritten into staging_prefix
+    (compose needs every source in the destination bucket), and more than
+    GCS_COMPOSE_MAX_COMPONENTS sources are composed in rounds. Objects created
+    under staging_prefix are deleted afterwards.
+
+    Only valid for formats whose files can be concatenated byte-for-byte.
+
+    Returns:
+        str: The public URL of the composed object.
+    """
+    client = client or gcs_client
+    if not client:
+        raise ValueError("GCS client is not initialized. Skipping compose.")
+
+    bucket = client.bucket(bucket_name)
+    temporary_blobs = []
+    try:
+        logger.info(f"Composing {len(blobs)} objects into GCS object {destination_blob_name}")
+        components = list(blobs)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(blobs)))) as executor:
+            futures = {}
+            for i, blob in enumerate(blobs):
+                if blob.bucket.name != bucket_name:
+                    staged_blob = bucket.blob(f"{staging_prefix}/rewrite_{i:05d}")
+                    temporary_blobs.append(staged_blob)
+                    futures[i] = executor.submit(_rewrite_blob, blob, staged_blob)
+            for i, future in futures.items():
+                components[i] = future.result()
+
+        level = 0
+        while len(components) > GCS_COMPOSE_MAX_COMPONENTS:
+            composed = []
+            for start in range(0, len(components), GCS_COMPOSE_MAX_COMPONENTS):
+                group = components[start:start + GCS_COMPOSE_MAX_COMPONENTS]
+                intermediate = bucket.blob(f"{staging_prefix}/compose_{level}_{start:05d}")
+                temporary_blobs.append(intermediate)
+                intermediate.compose(group, retry=DEFAULT_RETRY)
+                composed.append(intermediate)
+            components = composed
+            level += 1
+
+        destination = bucket.blob(destination_blob_name)
+        destination.content_type = content_type
+        if metadata:
+            destination.metadata = metadata
+        destination.compose(components, retry=DEFAULT_RETRY)
+        logger.info(f"Objects composed successfully in GCS: {destination.public_url}")
+        return destination.public_url
+    except Exception as e:
+        logger.error(f"Error composing objects in GCS: {e}")
+        raise
+    finally:
+        if temporary_blobs:
+            try:
+                # Objects that were never created just 404, which is fine here
+                bucket.delete_blobs(temporary_blobs, on_error=lambda blob: None)
+            except Exception as e:
+                logger.warning(f"Failed to delete GCS staging objects under {staging_prefix}: {e}")
+
+
+def compose_urls_to_gcs(urls, bucket_name, destination_blob_name, staging_prefix, content_type=None, max_workers=8):
+    """
+    Concatenates the bytes behind urls into a single GCS object without any
+    local processing: each URL is streamed into a staging object, then the
+    staging objects are joined with compose_blobs_to_gcs. Staging objects are
+    deleted afterwards.
+
+    Only valid for formats whose files can be concatenated byte-for-byte,
+    such as MP3 streams sharing codec parameters.
+
+    Returns:
+        str: The public URL of the composed object.
+    """
+    if not gcs_client:
+        raise ValueError("GCS client is not initialized. Skipping compose.")
+
+    bucket = gcs_client.bucket(bucket_name)
+    session = get_http_session()
+    staged_blobs = [bucket.blob(f"{staging_prefix}/{i:05d}", chunk_size=GCS_UPLOAD_CHUNK_SIZE) for i in range(len(urls))]
+
+    def stage(url, blob):
+        with session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            blob.upload_from_file(r.raw, content_type=content_type)
+        return blob
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as executor:
+            components = list(executor.map(stage, urls, staged_blobs))
+        return compose_blobs_to_gcs(
+            components,
+            bucket_name,
+            destination_blob_name,
+            staging_prefix,
+            content_type=content_type,
+            max_workers=max_workers
+        )
+    finally:
+        try:
+            bucket.delete_blobs(staged_blobs, on_error=lambda blob: None)
+        except Exception as e:
+            logger.warning(f"Failed to delete GCS staging objects under {staging_prefix}: {e}")
+
+
+# The JobsClient owns a gRPC channel; build it once per process and reuse it
+_jobs_client = None
+_jobs_credentials_info = None
+_jobs_client_lock = threading.Lock()
+
+def get_jobs_client():
+    """Returns the cached (JobsClient, credentials_info) pair, creating it on first use."""
+    global _jobs_client, _jobs_credentials_info
+
+    if _jobs_client is None:
+        with _jobs_client_lock:
+            if _jobs_client is None:
+                # Retrieve service account credentials
+                json_str = os.environ.get("GCP_SA_CREDENTIALS")
+                if not json_str:
+                    raise ValueError("GCP_SA_CREDENTIALS environment variable not set.")
+
+                credentials_info = json.loads(json_str)
+                credentials = service_account.Credentials.from_service_account_info(credentials_info)
+
+                # Initialize the JobsClient with the provided credentials
+                _jobs_credentials_info = credentials_info
+                _jobs_client = JobsClient(credentials=credentials)
+
+    return _jobs_client, _jobs_credentials_info
+
+
+# Attempts (including the first) made for transient run_job failures
+RUN_JOB_MAX_ATTEMPTS = 3
+
+def _run_job_retry_policy():
+    """
+    Retries only transient errors (429, 500, 503) with exponential backoff and
+    jitter, giving up after RUN_JOB_MAX_ATTEMPTS attempts or 30 seconds.
+    Permanent errors such as permission failures are raised immediately.
+    """
+    failures = 0
+
+    def predicate(exc):
+        nonlocal failures
+        failures += 1
+        return failures < RUN_JOB_MAX_ATTEMPTS and retry.if_transient_error(exc)
+
+    return retry.Retry(predicate=predicate, initial=0.5, maximum=8.0, multiplier=2.0, timeout=30.0)
+
+
 def trigger_cloud_run_job(job_name, location="us-central1", overrides=None):
-    # (Rest of the trigger_cloud_run_job function remains unchanged)
-    # Retrieve service account credentials
-    json_str = os.environ.get("GCP_SA_CREDENTIALS")
-    if not json_str:
-        raise ValueError("GCP_SA_CREDENTIALS environment variable not set.")
-    
-    credentials_info = json.loads(json_str)
-    credentials = service_account.Credentials.from_service_account_info(credentials_info)
-
-    # Initialize the JobsClient with the provided credentials
-    client = JobsClient(credentials=credentials)
+    client, credentials_info = get_jobs_client()
 
     # Construct the job path using project ID and location
     project_id = credentials_info.get("project_id")
@@ -91,7 +420,7 @@ def trigger_cloud_run_job(job_name, location="us-central1", overrides=None):
 
     try:
         # Trigger the job (non-blocking)
-        operation = client.run_job(request=request)
+        operation = client.run_job(request=request, retry=_run_job_retry_policy())
 
         return {
             "operation_name": operation.operation.name,  # Return operation name to track job status
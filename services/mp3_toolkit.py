@@ -0,0 +1,142 @@
+# Copyright (c) 2025 Stephen G. Pope
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY and FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+
+# Helpers for working with MP3 files at the frame level, without FFmpeg.
+
+# Leading bytes read to find the first frame header of a remote MP3
+MP3_HEAD_PROBE_BYTES = 64 * 1024
+
+# An ID3v1 tag occupies the last 128 bytes of a file
+ID3V1_TAG_SIZE = 128
+
+# MPEG audio Layer III frame header lookup tables (indexed by version id)
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+MP3_BITRATES_V1 = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+MP3_BITRATES_V2 = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+
+
+def _frame_header(data, offset, end):
+    """
+    Parses the MPEG audio Layer III frame header at offset, reading nothing
+    at or past end. Returns ((version, sample_rate, channels, bitrate_kbps),
+    frame_length, side_info), or None if there is no valid header there.
+    """
+    if end - offset < 4 or data[offset] != 0xFF or (data[offset + 1] & 0xE0) != 0xE0:
+        return None
+
+    version = (data[offset + 1] >> 3) & 0x3
+    layer = (data[offset + 1] >> 1) & 0x3
+    bitrate_index = data[offset + 2] >> 4
+    sample_rate_index = (data[offset + 2] >> 2) & 0x3
+    padding = (data[offset + 2] >> 1) & 0x1
+    channels = 1 if data[offset + 3] >> 6 == 3 else 2
+    if version == 1 or layer != 1 or sample_rate_index == 3 or bitrate_index in (0, 15):
+        return None
+
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    if version == 3:
+        bitrate = MP3_BITRATES_V1[bitrate_index]
+        frame_length = 144000 * bitrate // sample_rate + padding
+        side_info = 32 if channels == 2 else 17
+    else:
+        bitrate = MP3_BITRATES_V2[bitrate_index]
+        frame_length = 72000 * bitrate // sample_rate + padding
+        side_info = 17 if channels == 2 else 9
+    return (version, sample_rate, channels, bitrate), frame_length, side_info
+
+
+def mp3_frames_span(data):
+    """
+    Returns (start, end, (version, sample_rate, channels, bitrate_kbps)) for
+    the audio frames in a CBR MP3 file, skipping ID3v2/ID3v1 tags and a
+    leading Info header frame (it describes a single file and would give a
+    joined file the wrong duration). The format is read from the first audio
+    frame.
+
+    Returns None if data is not MPEG audio Layer III, or if it starts with a
+    Xing or VBRI header: that marks a VBR file, and without the header its
+    duration can only be estimated from the first frame's bitrate.
+    """
+    start, end = 0, len(data)
+    if data[:3] == b'ID3' and end >= 10:
+        # The ID3v2 size is a synchsafe integer (7 bits per byte)
+        size = (data[6] & 0x7f) << 21 | (data[7] & 0x7f) << 14 | (data[8] & 0x7f) << 7 | (data[9] & 0x7f)
+        start = 10 + size + (10 if data[5] & 0x10 else 0)
+    if end - start >= 128 and data[end - 128:end - 125] == b'TAG':
+        end -= 128
+
+    header = _frame_header(data, start, end)
+    if header is None:
+        return None
+    mp3_format, frame_length, side_info = header
+
+    tag_offset = start + 4 + side_info
+    if data[tag_offset:tag_offset + 4] == b'Xing' or data[start + 36:start + 40] == b'VBRI':
+        return None
+    if data[tag_offset:tag_offset + 4] == b'Info':
+        start += frame_length
+        header = _frame_header(data, start, end)
+        if header is None:
+            return None
+        mp3_format = header[0]
+
+    return start, end, mp3_format
+
+
+def composable_mp3_info(head, size, tail):
+    """
+    Describes an MP3 for byte-level joining (e.g. a GCS compose) from its
+    first bytes (head), total size and last ID3V1_TAG_SIZE bytes (tail).
+
+    Returns (format, bitrate_bps, has_id3v1), or None if the file does not
+    start directly with an audio frame: an ID3v2 tag or Xing/Info/VBRI header
+    frame would end up in the middle of the joined stream.
+    """
+    span = mp3_frames_span(head) if size >= 4 else None
+    if span is None or span[0] != 0:
+        return None
+
+    mp3_format = span[2]
+    bitrate = mp3_format[3] * 1000
+    has_id3v1 = size >= ID3V1_TAG_SIZE and tail[:3] == b'TAG'
+    return mp3_format, bitrate, has_id3v1
+
+
+def mp3s_composable(infos):
+    """
+    Whether MP3s described by composable_mp3_info can be joined byte for
+    byte: all share one format (including the bitrate, so the joined file is
+    still CBR) and only the last one ends in an ID3v1 tag.
+    """
+    if not infos or any(info is None for info in infos):
+        return False
+    if len({info[0] for info in infos}) != 1:
+        return False
+    return not any(has_id3v1 for _, _, has_id3v1 in infos[:-1])
+
+
+def composed_mp3_duration(sizes, infos):
+    """
+    Estimates the duration in seconds of MP3s joined byte for byte from each
+    file's bitrate and audio byte count, the way ffprobe estimates MP3s that
+    have no Xing header.
+    """
+    return sum(
+        (size - (ID3V1_TAG_SIZE if has_id3v1 else 0)) * 8 / bitrate
+        for size, (_, bitrate, has_id3v1) in zip(sizes, infos)
+    )
@@ -19,20 +19,60 @@
 import os
 import boto3
 import logging
+import threading
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
 from urllib.parse import urlparse, quote
 
 logger = logging.getLogger(__name__)
 
+# Multipart settings for uploads: files above 8 MiB are split into 8 MiB parts
+# that are sent by up to 8 threads in parallel.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True
+)
+
+# Clients are expensive to build (botocore loads its data files and opens a
+# new connection pool), so keep one per set of connection settings
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+def _get_client(s3_url, access_key, secret_key, region):
+    key = (s3_url, access_key, secret_key, region)
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            session = boto3.Session(
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                region_name=region
+            )
+            client = session.client(
+                's3',
+                endpoint_url=s3_url,
+                config=Config(
+                    max_pool_connections=32,
+                    retries={'max_attempts': 3, 'mode': 'adaptive'}
+                )
+            )
+            _CLIENTS[key] = client
+    return client
+
+def _file_url(s3_url, bucket_name, target_key):
+    # URL encode the entire target_key
+    encoded_key = quote(target_key, safe=':/') # Use safe characters for S3 path structure
+
+    # Construct the URL, assuming the S3_ENDPOINT_URL is base-compatible
+    # Example: https://sgp-labs.nyc3.digitaloceanspaces.com/bucket_name/merged_audio/job_id.mp3
+    return f"{s3_url}/{bucket_name}/{encoded_key}"
+
 # FIX: Add destination_path to the function signature
 def upload_to_s3(file_path, s3_url, access_key, secret_key, bucket_name, region, destination_path):
     
-    session = boto3.Session(
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        region_name=region
-    )
-    
-    client = session.client('s3', endpoint_url=s3_url)
+    client = _get_client(s3_url, access_key, secret_key, region)
 
     # Use the provided destination_path as the key name in the bucket (e.g., 'merged_audio/job_id.mp3')
     target_key = destination_path 
@@ -40,25 +80,43 @@ def upload_to_s3(file_path, s3_url, access_key, secret_key, bucket_name, region,
     try:
         logger.info(f"Uploading file to S3: {file_path} to s3://{bucket_name}/{target_key}")
         
-        # Upload the file to the specified S3 bucket using the target_key
-        with open(file_path, 'rb') as data:
-            client.upload_fileobj(
-                data, 
-                bucket_name, 
-                target_key, # FIX: Use target_key instead of os.path.basename(file_path)
-                ExtraArgs={'ACL': 'public-read'}
-            )
+        # Upload the file to the specified S3 bucket using the target_key.
+        # upload_file reads the parts straight from disk, in parallel.
+        client.upload_file(
+            file_path,
+            bucket_name,
+            target_key, # FIX: Use target_key instead of os.path.basename(file_path)
+            ExtraArgs={'ACL': 'public-read'},
+            Config=TRANSFER_CONFIG
+        )
 
         # FIX: The file URL should use the entire target_key (which includes the 'folder')
-        # URL encode the entire target_key
-        encoded_key = quote(target_key, safe=':/') # Use safe characters for S3 path structure
-        
-        # Construct the URL, assuming the S3_ENDPOINT_URL is base-compatible
-        # Example: https://sgp-labs.nyc3.digitaloceanspaces.com/bucket_name/merged_audio/job_id.mp3
-        file_url = f"{s3_url}/{bucket_name}/{encoded_key}"
+        file_url = _file_url(s3_url, bucket_name, target_key)
         
         logger.info(f"File uploaded successfully to S3: {file_url}")
         return file_url
     except Exception as e:
         logger.error(f"Error uploading file to S3: {e}")
         raise
+
+def upload_stream_to_s3(stream, s3_url, access_key, secret_key, bucket_name, region, destination_path, content_type=None):
+    """
+    Uploads a readable, possibly non-seekable stream (e.g. a subprocess pipe)
+    to S3. boto3 reads it part by part into a multipart upload.
+    """
+    client = _get_client(s3_url, access_key, secret_key, region)
+
+    extra_args = {'ACL': 'public-read'}
+    if content_type:
+        extra_args['ContentType'] = content_type
+
+    try:
+        logger.info(f"Uploading stream to S3: s3://{bucket_name}/{destination_path}")
+        client.upload_fileobj(stream, bucket_name, destination_path, ExtraArgs=extra_args, Config=TRANSFER_CONFIG)
+
+        file_url = _file_url(s3_url, bucket_name, destination_path)
+        logger.info(f"Stream uploaded successfully to S3: {file_url}")
+        return file_url
+    except Exception as e:
+        logger.error(f"Error uploading stream to S3: {e}")
+        raise
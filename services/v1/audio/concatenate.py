@@ -1,25 +1,91 @@
 # routes/v1/audio/concatenate.py
-# 实现了 GCS 下载、pydub 合并和 GCS 上传功能。
+# 实现了 GCS compose 服务端合并、FFmpeg concat 合并 (格式不一致时回退到 pydub) 和 GCS 上传功能。
 # 必须安装: pydub, requests, google-cloud-storage
 
 from flask import Blueprint
 from app import app # 引入主应用实例以访问 queue_task
 import time
 import os
-import io
-import requests
+import errno
+import mmap
+import shutil
+import logging
+import tempfile
+import subprocess
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
 from pydub import AudioSegment
+from requests.adapters import HTTPAdapter
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
+from services.file_management import download_file, get_http_session, DOWNLOAD_TIMEOUT
+from services.ffmpeg_toolkit import can_stream_copy, write_concat_list, FFMPEG_RW_TIMEOUT_US
+from services.gcp_toolkit import compose_blobs_to_gcs, parse_gcs_object_url, merge_cache_blob_name
+from services.mp3_toolkit import (
+    MP3_HEAD_PROBE_BYTES,
+    ID3V1_TAG_SIZE,
+    mp3_frames_span,
+    composable_mp3_info,
+    mp3s_composable,
+    composed_mp3_duration
+)
+from config import LOCAL_STORAGE_PATH, CONCAT_WITH_GCS_COMPOSE, MERGE_CACHE_ENABLED
+
+logger = logging.getLogger(__name__)
 
 # --- 配置项 ---
 # 请设置您的 GCS 存储桶名称，用于存放最终合并的音频文件。
 RESULT_GCS_BUCKET_NAME = os.environ.get("RESULT_GCS_BUCKET_NAME", "your-default-merged-audio-bucket")
 # ---
 
+# 分块大小: 结果以 8 MiB 为单位进行可续传上传/分块下载
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# GCS 客户端的 HTTP 连接池大小，需不小于并行下载数，避免线程排队等待连接
+GCS_POOL_SIZE = 32
+
+# 每个任务同时下载的输入数量上限
+MAX_DOWNLOAD_WORKERS = 16
+
+# 合并失败时只记录 FFmpeg stderr 的末尾部分
+FFMPEG_ERROR_TAIL_BYTES = 4096
+
+# 下载以及向 FFmpeg 写入输入时的复制块大小
+FEED_CHUNK_SIZE = 1024 * 1024
+
+# 同一进程内同时运行的 FFmpeg 进程上限，避免并发任务争抢 CPU
+MAX_CONCURRENT_FFMPEG = int(os.environ.get("MAX_CONCURRENT_FFMPEG", os.cpu_count() or 1))
+_ffmpeg_slots = threading.BoundedSemaphore(MAX_CONCURRENT_FFMPEG)
+# 单个 FFmpeg 进程的运行时间上限 (秒)，超时后终止，避免卡住的输入一直占用并发名额
+FFMPEG_TIMEOUT_SECONDS = int(os.environ.get("FFMPEG_TIMEOUT_SECONDS", "3600"))
+
+# 是否让 FFmpeg 直接从 URL 读取输入 (gs:// 使用签名 URL)，不先下载到本地磁盘
+STREAM_INPUTS_FROM_URLS = os.environ.get("STREAM_INPUTS_FROM_URLS", "true").lower() == "true"
+# 签名 URL 有效期: concat demuxer 按顺序才打开每个输入，需覆盖整个合并耗时
+SIGNED_URL_TTL_SECONDS = int(os.environ.get("SIGNED_URL_TTL_SECONDS", "3600"))
+
+
+def _create_gcs_client():
+    """
+    创建共享的 GCS 客户端，底层会话使用更大的连接池。
+    storage.Client 只对 credentials 设置 scope，不会处理传入的 _http，所以这里必须显式请求 scope；
+    瞬时错误由 storage 库自身的 DEFAULT_RETRY 重试，会话层不再重试，避免重试次数叠加。
+    """
+    credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=GCS_POOL_SIZE, pool_maxsize=GCS_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return storage.Client(project=project, credentials=credentials, _http=session)
+
+
 # 初始化 GCS 客户端
 # 客户端初始化放在外面，避免在每次请求时重复创建
 try:
-    gcs_client = storage.Client()
+    gcs_client = _create_gcs_client()
 except Exception as e:
     # 打印警告，但允许 Worker 继续运行 (假设在具有默认凭证的环境中)
     print(f"Warning: GCS Client initialization failed. Check credentials: {e}")
@@ -29,8 +95,8 @@ except Exception as e:
 audio_bp = Blueprint('audio', __name__, url_prefix='/v1/audio')
 
 
-def _download_gcs_file_to_memory(gcs_url):
-    """从 GCS URL (gs:// 或 https://) 下载文件内容到内存流。"""
+def _download_gcs_file(gcs_url, local_path):
+    """从 GCS URL (gs:// 或 https://) 下载文件到本地路径。"""
     if gcs_client is None:
         raise Exception("GCS Client is not initialized. Check authentication.")
 
@@ -41,37 +107,274 @@ def _download_gcs_file_to_memory(gcs_url):
         blob_name = parts[1]
         
         bucket = gcs_client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-        file_bytes = blob.download_as_bytes()
-        return io.BytesIO(file_bytes)
+        blob = bucket.blob(blob_name, chunk_size=UPLOAD_CHUNK_SIZE)
+        blob.download_to_filename(local_path)
+        return local_path
         
     elif "storage.googleapis.com" in gcs_url:
-        # 针对公开的 HTTP 链接，使用 requests
-        response = requests.get(gcs_url, stream=True)
-        response.raise_for_status()
-        return io.BytesIO(response.content)
+        # 针对公开的 HTTP 链接，复用共享会话的连接池 (keep-alive，免去每次 TLS 握手) 流式写入文件
+        with get_http_session().get(gcs_url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            with open(local_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=FEED_CHUNK_SIZE):
+                    f.write(chunk)
+        return local_path
+    else:
+        raise ValueError(f"Unsupported URL format: {gcs_url}. Must be gs:// or storage.googleapis.com link.")
+
+
+def _run_ffmpeg(cmd):
+    """
+    运行 FFmpeg 命令并返回结果 (stderr 已捕获)；并发数量受 MAX_CONCURRENT_FFMPEG 限制。
+    运行超过 FFMPEG_TIMEOUT_SECONDS 时终止进程并抛出 subprocess.TimeoutExpired。
+    """
+    with _ffmpeg_slots:
+        return subprocess.run(
+            cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False, timeout=FFMPEG_TIMEOUT_SECONDS
+        )
+
+
+def _streamable_url(gcs_url):
+    """将输入转换为 FFmpeg 可直接读取的 HTTPS 链接 (gs:// 生成 V4 签名 URL)。"""
+    if gcs_url.startswith("gs://"):
+        if gcs_client is None:
+            raise Exception("GCS Client is not initialized. Check authentication.")
+        bucket_name, blob_name = gcs_url[5:].split('/', 1)
+        blob = gcs_client.bucket(bucket_name).blob(blob_name)
+        return blob.generate_signed_url(
+            version="v4",
+            expiration=timedelta(seconds=SIGNED_URL_TTL_SECONDS),
+            method="GET"
+        )
+    elif "storage.googleapis.com" in gcs_url:
+        return gcs_url
     else:
         raise ValueError(f"Unsupported URL format: {gcs_url}. Must be gs:// or storage.googleapis.com link.")
 
 
-def _upload_file_from_memory(data_stream, destination_blob_name, content_type="audio/mp3"):
-    """将内存流中的内容上传到目标 GCS 桶。"""
+def _concat_from_urls(audio_urls, concat_file_path, output_path):
+    """
+    让 FFmpeg 直接从 HTTPS 读取所有片段并以 -c copy 合并，片段不落地到本地磁盘。
+    成功返回 True；签名失败、片段格式不一致、FFmpeg 出错或超时时返回 False，由调用方回退到下载流程。
+    """
+    try:
+        urls = [_streamable_url(url) for url in audio_urls]
+    except Exception as e:
+        logger.warning("Could not build streamable URLs, downloading clips instead: %s", e)
+        return False
+
+    # 格式不一致时 -c copy 仍会返回 0 但输出损坏，必须先用 ffprobe 确认所有片段编码/采样率/声道相同
+    if not can_stream_copy(urls, max(1, min(MAX_DOWNLOAD_WORKERS, len(urls)))):
+        logger.info("Clips differ in format, downloading them for a re-encoding merge.")
+        return False
+
+    # seekable 0: 按顺序读取 HTTP 输入，避免探测时额外的 Range 请求；
+    # rw_timeout: GCS 读取停滞时 FFmpeg 报错退出，而不是一直等待
+    write_concat_list(concat_file_path, urls, file_options={'seekable': '0', 'rw_timeout': FFMPEG_RW_TIMEOUT_US})
+
+    cmd = [
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+        '-protocol_whitelist', 'file,http,https,tcp,tls',
+        '-thread_queue_size', '1024', '-fflags', '+genpts',
+        '-f', 'concat', '-safe', '0',
+        '-i', concat_file_path,
+        '-c', 'copy',
+        output_path
+    ]
+    try:
+        result = _run_ffmpeg(cmd)
+    except subprocess.TimeoutExpired:
+        logger.warning("Streaming concat timed out after %ss, downloading clips instead.", FFMPEG_TIMEOUT_SECONDS)
+        return False
+    if result.returncode != 0:
+        stderr_tail = result.stderr[-FFMPEG_ERROR_TAIL_BYTES:].decode('utf-8', errors='replace')
+        logger.warning("Streaming concat failed, downloading clips instead: %s", stderr_tail)
+        return False
+    return True
+
+
+def _upload_file(local_path, destination_blob_name, content_type="audio/mp3", metadata=None):
+    """将本地文件上传到目标 GCS 桶。"""
     if gcs_client is None:
         raise Exception("GCS Client is not initialized. Check authentication.")
         
     bucket = gcs_client.bucket(RESULT_GCS_BUCKET_NAME)
-    blob = bucket.blob(destination_blob_name)
-    
-    # 将流的指针重置到开头
-    data_stream.seek(0)
+    # 设置 chunk_size 后使用可续传上传，按块发送，单块失败可重试
+    blob = bucket.blob(destination_blob_name, chunk_size=UPLOAD_CHUNK_SIZE)
+    blob.metadata = metadata
     
     # 上传文件
-    blob.upload_from_file(data_stream, content_type=content_type)
+    blob.upload_from_filename(local_path, content_type=content_type, retry=DEFAULT_RETRY)
     
     # 返回文件的公共访问 URL (如果桶设置允许)
     return blob.public_url
 
 
+def _fast_mp3_concat(input_paths, output_path):
+    """
+    当所有输入都是相同 version/采样率/声道/码率的 CBR MP3 时，直接按顺序拼接音频帧，
+    无需启动 FFmpeg。格式不一致或含 Xing/VBRI 头 (VBR) 时返回 False，由调用方改用 FFmpeg:
+    拼接结果没有 VBR 头，播放器只能按第一帧码率估算时长。
+    """
+    files, maps = [], []
+    try:
+        spans = []
+        for path in input_paths:
+            f = open(path, 'rb')
+            files.append(f)
+            if os.fstat(f.fileno()).st_size == 0:
+                return False
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            maps.append(mm)
+            span = mp3_frames_span(mm)
+            if span is None or (spans and span[2] != spans[0][2]):
+                return False
+            spans.append(span)
+
+        with open(output_path, 'wb') as out:
+            for mm, (start, end, _) in zip(maps, spans):
+                with memoryview(mm) as view:
+                    out.write(view[start:end])
+        return True
+    finally:
+        for mm in maps:
+            mm.close()
+        for f in files:
+            f.close()
+
+
+def _inspect_composable_mp3(blob):
+    """读取对象开头和结尾的少量字节，返回 composable_mp3_info 的结果。"""
+    if not blob.size or blob.size < 4:
+        return None
+    head = blob.download_as_bytes(start=0, end=min(blob.size, MP3_HEAD_PROBE_BYTES) - 1)
+    if blob.size <= len(head):
+        tail = head[-ID3V1_TAG_SIZE:]
+    else:
+        tail = blob.download_as_bytes(start=blob.size - ID3V1_TAG_SIZE)
+    return composable_mp3_info(head, blob.size, tail)
+
+
+def _compose_gcs_mp3s(audio_urls, destination_blob_name, staging_prefix):
+    """
+    当所有输入都是 GCS 中格式相同、可逐字节拼接的 MP3 时，用 compose 在服务端
+    合并到结果桶的 destination_blob_name (超过 32 个时分层合并)，音频数据不经过本机。
+    返回合并结果的时长 (秒)；输入不满足条件时返回 None，由调用方改为本地合并。
+    """
+    objects = [parse_gcs_object_url(url) for url in audio_urls]
+    if any(obj is None for obj in objects):
+        return None
+
+    max_workers = max(1, min(MAX_DOWNLOAD_WORKERS, len(objects)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        blobs = list(executor.map(lambda obj: gcs_client.bucket(obj[0]).get_blob(obj[1]), objects))
+        # gzip 编码存储的对象逐字节拼接后无法解码
+        if any(blob is None or blob.content_encoding for blob in blobs):
+            return None
+        infos = list(executor.map(_inspect_composable_mp3, blobs))
+
+    if not mp3s_composable(infos):
+        return None
+    total_duration_seconds = composed_mp3_duration([blob.size for blob in blobs], infos)
+
+    compose_blobs_to_gcs(
+        blobs,
+        RESULT_GCS_BUCKET_NAME,
+        destination_blob_name,
+        staging_prefix,
+        content_type="audio/mp3",
+        metadata={"duration_seconds": str(total_duration_seconds)},
+        max_workers=max_workers,
+        client=gcs_client
+    )
+    return total_duration_seconds
+
+
+def _merge_clips_locally(audio_urls, scratch_dir):
+    """在 scratch_dir 中合并所有片段，返回合并后的本地文件路径。"""
+    clip_paths = [os.path.join(scratch_dir, f"clip_{i}.mp3") for i in range(len(audio_urls))]
+    concat_file_path = os.path.join(scratch_dir, "concat_list.txt")
+    output_path = os.path.join(scratch_dir, "merged.mp3")
+    os.makedirs(scratch_dir, exist_ok=True)
+
+    if STREAM_INPUTS_FROM_URLS and _concat_from_urls(audio_urls, concat_file_path, output_path):
+        # FFmpeg 直接从 GCS 流式读取并拷贝音频流，片段无需写入本地磁盘
+        logger.info("Merged %d clips straight from their URLs.", len(audio_urls))
+        return output_path
+
+    # 并行下载所有片段到本地临时文件 (按输入顺序命名)
+    max_workers = max(1, min(MAX_DOWNLOAD_WORKERS, len(audio_urls)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(_download_gcs_file, audio_urls, clip_paths))
+    logger.info("Downloaded %d clips.", len(audio_urls))
+
+    if _fast_mp3_concat(clip_paths, output_path):
+        # 所有片段格式相同: 直接拼接 MP3 帧，无需启动 FFmpeg
+        logger.info("Clips share one MP3 format, joined frames directly.")
+        return output_path
+
+    # 格式不一致时 -c copy 仍会返回 0 但输出损坏，所以在运行 FFmpeg 之前就决定是否重新编码
+    if not can_stream_copy(clip_paths, max_workers):
+        logger.info("Clips differ in format, re-encoding them with pydub.")
+        _concat_with_pydub(clip_paths, output_path)
+        return output_path
+
+    # 使用 concat demuxer 直接拷贝音频流: 无需解码/重新编码，内存占用恒定
+    write_concat_list(concat_file_path, clip_paths)
+
+    cmd = [
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+        '-thread_queue_size', '1024', '-fflags', '+genpts',
+        '-f', 'concat', '-safe', '0',
+        '-i', concat_file_path,
+        '-c', 'copy',
+        output_path
+    ]
+    result = _run_ffmpeg(cmd)
+    if result.returncode != 0:
+        stderr_tail = result.stderr[-FFMPEG_ERROR_TAIL_BYTES:].decode('utf-8', errors='replace')
+        raise Exception(f"FFmpeg concat failed with code {result.returncode}: {stderr_tail}")
+    return output_path
+
+
+def _probe_duration(file_path):
+    """使用 ffprobe 读取音频时长 (秒)。"""
+    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', file_path]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip())
+
+
+def _concat_with_pydub(clip_paths, output_path):
+    """
+    解码所有片段并重新编码为 MP3。
+    仅在各片段的采样率/声道不一致、无法使用 -c copy 时使用:
+    pydub 会在拼接时自动统一这些参数。
+    """
+    # 使用 pydub 加载 (pydub 会自动检测音频格式)
+    clips = [AudioSegment.from_file(clip_path) for clip_path in clip_paths]
+
+    # 统一到最高的采样率/声道数/采样位宽 (与 pydub 的 "+" 运算规则相同)，
+    # 然后一次性拼接原始 PCM 数据，避免 "+=" 每次都复制整个已合并的缓冲区
+    frame_rate = max(clip.frame_rate for clip in clips)
+    channels = max(clip.channels for clip in clips)
+    sample_width = max(clip.sample_width for clip in clips)
+    clips = [
+        clip.set_frame_rate(frame_rate).set_channels(channels).set_sample_width(sample_width)
+        for clip in clips
+    ]
+    final_combined_audio = AudioSegment(
+        data=b"".join(clip.raw_data for clip in clips),
+        sample_width=sample_width,
+        frame_rate=frame_rate,
+        channels=channels
+    )
+    logger.info("%d clips merged. Duration: %.2f seconds.", len(clips), len(final_combined_audio) / 1000.0)
+
+    # 导出为 192k CBR MP3 (需要 FFmpeg)。"-q:a 0" 的最高质量 VBR 编码约慢一倍，
+    # 对拼接结果没有必要
+    final_combined_audio.export(output_path, format="mp3", codec="libmp3lame", bitrate="192k")
+
+
 @audio_bp.route('/concatenate', methods=['POST'])
 @app.queue_task() # 使用 app.queue_task 装饰器，实现异步执行和 Webhook 回调
 def concatenate_audio_route(job_id=None, data=None):
@@ -91,43 +394,68 @@ def concatenate_audio_route(job_id=None, data=None):
         return {"message": "Server Error: GCS credentials or client failed to initialize."}, endpoint, 500
 
     print(f"--- Job ID: {job_id}. Starting merge of {len(audio_urls)} clips. ---")
-    
-    # 初始化一个空的 AudioSegment
-    final_combined_audio = AudioSegment.empty()
+
+    # 每个任务使用独立的临时目录，结束时一次性删除
+    scratch_dir = os.path.abspath(os.path.join(LOCAL_STORAGE_PATH, job_id))
     
     # 2. 核心合并逻辑
     try:
-        for i, url in enumerate(audio_urls):
-            print(f"Downloading clip {i+1}/{len(audio_urls)}.")
-            
-            # 下载 GCS 文件内容到内存流
-            audio_stream = _download_gcs_file_to_memory(url)
-            
-            # 使用 pydub 加载 (pydub 会自动检测音频格式)
-            clip = AudioSegment.from_file(audio_stream)
-            
-            # 顺序追加音频段
-            final_combined_audio += clip
-            
-            print(f"Clip {i+1} merged. Current duration: {len(final_combined_audio) / 1000.0:.2f} seconds.")
-
-        # 3. 导出最终合并的音频到内存
-        output_buffer = io.BytesIO()
-        # 导出为 MP3 格式，参数 "-q:a 0" 表示最高质量 VBR MP3 (需要 FFmpeg)
-        final_combined_audio.export(output_buffer, format="mp3", parameters=["-q:a", "0"])
-        
-        # 4. 上传最终结果到 GCS
+        bucket = gcs_client.bucket(RESULT_GCS_BUCKET_NAME)
+        # 缓存键包含每个输入的版本 (GCS generation / ETag)，输入被原地覆盖后不会命中旧结果。
+        # 缓存只是优化: 查询失败时不使用缓存，继续合并
+        cache_blob_name = cached_blob = None
+        if MERGE_CACHE_ENABLED:
+            try:
+                cache_blob_name = merge_cache_blob_name(audio_urls, "merged/cache", client=gcs_client)
+                if cache_blob_name:
+                    cached_blob = bucket.get_blob(cache_blob_name)
+            except Exception as e:
+                logger.warning("Job %s: merge cache lookup failed, merging without it: %s", job_id, e)
+                cache_blob_name = cached_blob = None
+
+        # 相同的输入之前已合并过: 直接返回缓存结果，跳过下载/合并/上传
+        if cached_blob is not None:
+            logger.info("Job %s: Cache hit: %s", job_id, cached_blob.public_url)
+            return {
+                "final_url": cached_blob.public_url,
+                "clips_merged": len(audio_urls),
+                "total_duration_seconds": float((cached_blob.metadata or {}).get("duration_seconds", 0)),
+                "message": "Audio concatenation complete."
+            }, endpoint, 200
+
         unique_id = data.get("id", job_id)
         destination_blob_name = f"merged/result_{unique_id}_{int(time.time())}.mp3"
-        final_url = _upload_file_from_memory(output_buffer, destination_blob_name)
+        # 启用缓存时结果先写入缓存对象，再在服务端复制到目标路径 (不产生额外上传流量)
+        result_blob_name = cache_blob_name or destination_blob_name
+
+        total_duration_seconds = None
+        if CONCAT_WITH_GCS_COMPOSE:
+            try:
+                total_duration_seconds = _compose_gcs_mp3s(audio_urls, result_blob_name, f"merged/staging/{job_id}")
+            except Exception as e:
+                logger.warning("GCS compose failed, merging locally instead: %s", e)
+
+        if total_duration_seconds is not None:
+            logger.info("Composed %d clips in GCS without downloading them.", len(audio_urls))
+        else:
+            output_path = _merge_clips_locally(audio_urls, scratch_dir)
+            total_duration_seconds = _probe_duration(output_path)
+
+            # 3. 上传最终结果到 GCS
+            _upload_file(output_path, result_blob_name, metadata={"duration_seconds": str(total_duration_seconds)})
+
+        if cache_blob_name:
+            final_url = bucket.copy_blob(bucket.blob(cache_blob_name), bucket, destination_blob_name).public_url
+        else:
+            final_url = bucket.blob(destination_blob_name).public_url
         
         print(f"--- Audio concatenation successful. Final URL: {final_url} ---")
         
-        # 5. 成功响应 (通过 Webhook 发送)
+        # 4. 成功响应 (通过 Webhook 发送)
         return {
             "final_url": final_url,
             "clips_merged": len(audio_urls),
-            "total_duration_seconds": len(final_combined_audio) / 1000.0,
+            "total_duration_seconds": total_duration_seconds,
             "message": "Audio concatenation complete."
         }, endpoint, 200
 
@@ -140,3 +468,114 @@ def concatenate_audio_route(job_id=None, data=None):
             "job_id": job_id
         }, endpoint, 500
 
+    finally:
+        # 清理本地临时文件
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def _open_fifo_for_writing(fifo_path, process):
+    """
+    等待 FFmpeg 以读模式打开 fifo_path，返回可写的文件对象。
+    FFmpeg 先退出时抛出异常，避免合并失败后一直阻塞。
+    """
+    while True:
+        try:
+            fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            if process.poll() is not None:
+                raise Exception(f"FFmpeg exited with code {process.returncode} before reading all inputs")
+            time.sleep(0.05)
+    os.set_blocking(fd, True)
+    return os.fdopen(fd, 'wb')
+
+
+def process_audio_concatenate(media_urls, job_id, webhook_url=None):
+    """
+    将多个音频文件合并为一个。
+
+    下载与合并以流水线方式进行: concat 列表中每个输入对应一个 FIFO，FFmpeg 立即启动，
+    某个输入及其之前的输入全部下载完成后就写入对应的 FIFO，
+    因此后面的输入仍在下载时合并已经开始。
+    """
+    # 输入文件、FIFO 和 concat 列表都放在每个任务独立的临时目录中，结束时一次性删除；
+    # 只把输出文件留给调用方
+    scratch_dir = os.path.abspath(os.path.join(LOCAL_STORAGE_PATH, job_id))
+    input_files = [None] * len(media_urls)
+    fifo_paths = [os.path.join(scratch_dir, f"pipe_{i}") for i in range(len(media_urls))]
+    concat_file_path = os.path.join(scratch_dir, "concat_list.txt")
+    output_filename = f"{job_id}.mp3"
+    output_path = os.path.join(LOCAL_STORAGE_PATH, output_filename)
+    # FFmpeg 先写入临时目录，完成后再重命名到 output_path，
+    # 因此 output_path 不会出现未合并完成的文件
+    partial_output_path = os.path.join(scratch_dir, output_filename)
+
+    try:
+        os.makedirs(scratch_dir, exist_ok=True)
+        for fifo_path in fifo_paths:
+            os.mkfifo(fifo_path)
+
+        # 为 FFmpeg 生成使用绝对路径的 concat 列表文件
+        write_concat_list(concat_file_path, fifo_paths)
+
+        # 使用 concat demuxer 合并音频文件
+        cmd = [
+            'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+            '-thread_queue_size', '1024', '-fflags', '+genpts',
+            '-f', 'concat', '-safe', '0',
+            '-i', concat_file_path,
+            '-c', 'copy',
+            partial_output_path
+        ]
+
+        # 并行下载所有输入，结果按输入下标保存，保证合并顺序与请求顺序一致
+        max_workers = max(1, min(MAX_DOWNLOAD_WORKERS, len(media_urls)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+                tempfile.TemporaryFile(dir=scratch_dir) as stderr_file:
+            futures = [
+                executor.submit(
+                    download_file,
+                    media_item['audio_url'],
+                    scratch_dir
+                )
+                for i, media_item in enumerate(media_urls)
+            ]
+            # stderr 写入临时文件，避免管道写满导致 FFmpeg 阻塞
+            process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=stderr_file)
+            try:
+                for i, future in enumerate(futures):
+                    input_files[i] = future.result()
+                    logger.info("Job %s: Downloaded input %d/%d to %s", job_id, i + 1, len(media_urls), input_files[i])
+                    with _open_fifo_for_writing(fifo_paths[i], process) as fifo, open(input_files[i], 'rb') as src:
+                        shutil.copyfileobj(src, fifo, FEED_CHUNK_SIZE)
+                returncode = process.wait()
+            except Exception:
+                # 有下载失败后，不再启动仍在排队的下载
+                for future in futures:
+                    future.cancel()
+                process.kill()
+                process.wait()
+                stderr_file.seek(0)
+                stderr_tail = stderr_file.read()[-FFMPEG_ERROR_TAIL_BYTES:].decode('utf-8', errors='replace')
+                if stderr_tail:
+                    logger.error("Job %s: FFmpeg output: %s", job_id, stderr_tail)
+                raise
+
+            if returncode != 0:
+                stderr_file.seek(0)
+                stderr_tail = stderr_file.read()[-FFMPEG_ERROR_TAIL_BYTES:].decode('utf-8', errors='replace')
+                logger.error("Job %s: FFmpeg concat failed with code %d: %s", job_id, returncode, stderr_tail)
+                raise Exception(f"FFmpeg concat failed with code {returncode}")
+
+        os.replace(partial_output_path, output_path)
+        logger.info("Job %s: Audio combination successful: %s", job_id, output_path)
+
+        return output_path
+    except Exception as e:
+        logger.error("Job %s: Audio combination failed: %s", job_id, e)
+        raise
+    finally:
+        # 清理输入文件、FIFO 和 concat 列表
+        shutil.rmtree(scratch_dir, ignore_errors=True)
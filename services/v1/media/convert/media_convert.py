@@ -19,6 +19,7 @@ import ffmpeg
 import subprocess
 import logging
 from services.file_management import download_file
+from services.ffmpeg_toolkit import run_ffmpeg
 from config import LOCAL_STORAGE_PATH
 
 # Set up logging
@@ -102,7 +103,7 @@ def process_media_convert(media_url, job_id, output_format='mp4', video_codec='l
         logger.info(f"Running ffmpeg command: {' '.join(cmd)}")
         
         # Run the conversion
-        ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
+        run_ffmpeg(stream)
         
         # Clean up input file
         os.remove(input_filename)
@@ -20,6 +20,7 @@ import os
 import ffmpeg
 import requests
 from services.file_management import download_file
+from services.ffmpeg_toolkit import run_ffmpeg
 from config import LOCAL_STORAGE_PATH
 
 def process_media_to_mp3(media_url, job_id, bitrate='128k', sample_rate=None):
@@ -38,11 +39,10 @@ def process_media_to_mp3(media_url, job_id, bitrate='128k', sample_rate=None):
             output_options['ar'] = sample_rate
             
         # Convert media file to MP3 with specified options
-        (
+        run_ffmpeg(
             stream
             .output(output_path, **output_options)
             .overwrite_output()
-            .run(capture_stdout=True, capture_stderr=True)
         )
         os.remove(input_filename)
         sample_rate_info = f" and sample rate {sample_rate}Hz" if sample_rate is not None else ""
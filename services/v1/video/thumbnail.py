@@ -19,6 +19,7 @@
 import os
 import ffmpeg
 from services.file_management import download_file
+from services.ffmpeg_toolkit import run_ffmpeg
 from config import LOCAL_STORAGE_PATH
 
 def extract_thumbnail(video_url, job_id, second=0):
@@ -41,12 +42,11 @@ def extract_thumbnail(video_url, job_id, second=0):
     
     try:
         # Extract thumbnail using ffmpeg at the specified timestamp
-        (
+        run_ffmpeg(
             ffmpeg
             .input(video_path, ss=second)  # 'ss' is the seek parameter for the timestamp
             .output(thumbnail_path, vframes=1)  # vframes=1 extracts a single frame
             .overwrite_output()
-            .run(capture_stdout=True, capture_stderr=True)
         )
         
         # Clean up the downloaded video file